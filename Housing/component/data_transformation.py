@@ -3,6 +3,7 @@ from sklearn import preprocessing
 from Housing.logger import logging
 from Housing.exception import HousingException
 import sys,os
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
 from Housing.entity.config_entity import DataIngestionConfig,DataTransformationConfig,DataValidationConfig
@@ -11,9 +12,9 @@ from sklearn.base import BaseEstimator,TransformerMixin
 from Housing.constant import *
 from sklearn.compose import ColumnTransformer
 from sklearn.pipeline import Pipeline
-from sklearn.preprocessing import StandardScaler,OneHotEncoder
+from sklearn.preprocessing import OneHotEncoder
 from sklearn.impute import SimpleImputer
-from Housing.util.util import read_yaml_file,save_object,save_numpy_array_data,load_data
+from Housing.util.util import read_yaml_file,save_object,save_numpy_feature_target_data,load_data
 
 class FeatureGenerator(BaseEstimator, TransformerMixin):
 
@@ -29,40 +30,200 @@ class FeatureGenerator(BaseEstimator, TransformerMixin):
         population_ix: int index number of total population columns
         households_ix: int index number of  households columns
         total_bedrooms_ix: int index number of bedrooms columns
+        columns: list of column names, indices are looked up from it at fit time when given
         """
+        self.add_bedrooms_per_room = add_bedrooms_per_room
+        self.total_rooms_ix = total_rooms_ix
+        self.population_ix = population_ix
+        self.households_ix = households_ix
+        self.total_bedrooms_ix = total_bedrooms_ix
+        self.columns = columns
+
+    def fit(self, X, y=None):
         try:
-            self.columns = columns
             if self.columns is not None:
-                total_rooms_ix = self.columns.index(COLUMN_TOTAL_ROOMS)
-                population_ix = self.columns.index(COLUMN_POPULATION)
-                households_ix = self.columns.index(COLUMN_HOUSEHOLDS)
-                total_bedrooms_ix = self.columns.index(COLUMN_TOTAL_BEDROOM)
-
-            self.add_bedrooms_per_room = add_bedrooms_per_room
-            self.total_rooms_ix = total_rooms_ix
-            self.population_ix = population_ix
-            self.households_ix = households_ix
-            self.total_bedrooms_ix = total_bedrooms_ix
+                column_positions = {column: ix for ix, column in enumerate(self.columns)}
+                self.total_rooms_ix_ = column_positions[COLUMN_TOTAL_ROOMS]
+                self.population_ix_ = column_positions[COLUMN_POPULATION]
+                self.households_ix_ = column_positions[COLUMN_HOUSEHOLDS]
+                self.total_bedrooms_ix_ = column_positions[COLUMN_TOTAL_BEDROOM]
+            else:
+                self.total_rooms_ix_ = self.total_rooms_ix
+                self.population_ix_ = self.population_ix
+                self.households_ix_ = self.households_ix
+                self.total_bedrooms_ix_ = self.total_bedrooms_ix
+            self.n_generated_features_ = 3 if self.add_bedrooms_per_room else 2
+            return self
         except Exception as e:
             raise HousingException(e, sys) from e
 
-    def fit(self, X, y=None):
-        return self
-
     def transform(self, X, y=None):
         try:
-            room_per_household = X[:, self.total_rooms_ix] / \
-                                 X[:, self.households_ix]
-            population_per_household = X[:, self.population_ix] / \
-                                       X[:, self.households_ix]
+            if not hasattr(self, "n_generated_features_"):
+                # objects pickled before indices were resolved at fit time
+                self.fit(X)
+
+            n_rows, n_columns = X.shape
+
+            generated_feature = np.empty((n_rows, n_columns + self.n_generated_features_), dtype=np.float32)
+            generated_feature[:, :n_columns] = X
+
+            # room_per_household
+            np.divide(X[:, self.total_rooms_ix_], X[:, self.households_ix_],
+                      out=generated_feature[:, n_columns])
+            # population_per_household
+            np.divide(X[:, self.population_ix_], X[:, self.households_ix_],
+                      out=generated_feature[:, n_columns + 1])
             if self.add_bedrooms_per_room:
-                bedrooms_per_room = X[:, self.total_bedrooms_ix] / \
-                                    X[:, self.total_rooms_ix]
-                generated_feature = np.c_[
-                    X, room_per_household, population_per_household, bedrooms_per_room]
+                # bedrooms_per_room
+                np.divide(X[:, self.total_bedrooms_ix_], X[:, self.total_rooms_ix_],
+                          out=generated_feature[:, n_columns + 2])
+
+            return generated_feature
+        except Exception as e:
+            raise HousingException(e, sys) from e
+
+
+class FusedNumericPreprocessor(BaseEstimator, TransformerMixin):
+
+    def __init__(self, add_bedrooms_per_room=True,
+                 total_rooms_ix=3,
+                 population_ix=5,
+                 households_ix=6,
+                 total_bedrooms_ix=4, columns=None, block_size=65536):
+        """
+        FusedNumericPreprocessor Initialization
+        Median imputation, ratio feature generation and standard scaling done
+        together, walking X in row blocks
+        add_bedrooms_per_room: bool
+        total_rooms_ix: int index number of total rooms columns
+        population_ix: int index number of total population columns
+        households_ix: int index number of  households columns
+        total_bedrooms_ix: int index number of bedrooms columns
+        columns: list of numerical column names, indices are looked up from it at fit time when given
+        block_size: int number of rows processed per block
+        """
+        self.add_bedrooms_per_room = add_bedrooms_per_room
+        self.total_rooms_ix = total_rooms_ix
+        self.population_ix = population_ix
+        self.households_ix = households_ix
+        self.total_bedrooms_ix = total_bedrooms_ix
+        self.columns = columns
+        self.block_size = block_size
+
+    def _generate_block(self, X_block, out_block):
+        """
+        Writes the imputed block and its generated ratio columns into out_block
+        """
+        n_columns = X_block.shape[1]
+        imputed = out_block[:, :n_columns]
+        imputed[...] = X_block
+        np.copyto(imputed, self.medians_, where=np.isnan(X_block))
+
+        # zero denominators are reported by the finite check below
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.divide(imputed[:, self.total_rooms_ix_], imputed[:, self.households_ix_],
+                      out=out_block[:, n_columns])
+            np.divide(imputed[:, self.population_ix_], imputed[:, self.households_ix_],
+                      out=out_block[:, n_columns + 1])
+            if self.add_bedrooms_per_room:
+                np.divide(imputed[:, self.total_bedrooms_ix_], imputed[:, self.total_rooms_ix_],
+                          out=out_block[:, n_columns + 2])
+
+        # the streamed statistics and the trainer would turn inf or nan into silent NaN features
+        non_finite_columns = np.flatnonzero(~np.isfinite(out_block).all(axis=0))
+        if len(non_finite_columns) > 0:
+            raise ValueError(f"Input contains infinity or NaN in feature columns {non_finite_columns.tolist()} "
+                             f"after imputation and feature generation.")
+
+    def _fit(self, X, generated_feature=None):
+        """
+        Learns medians and scaling statistics from X. When generated_feature is given
+        the imputed and generated rows are kept in it, otherwise a single block buffer is reused
+        """
+        n_rows, n_columns = X.shape
+
+        if self.columns is not None:
+            column_positions = {column: ix for ix, column in enumerate(self.columns)}
+            self.total_rooms_ix_ = column_positions[COLUMN_TOTAL_ROOMS]
+            self.population_ix_ = column_positions[COLUMN_POPULATION]
+            self.households_ix_ = column_positions[COLUMN_HOUSEHOLDS]
+            self.total_bedrooms_ix_ = column_positions[COLUMN_TOTAL_BEDROOM]
+        else:
+            self.total_rooms_ix_ = self.total_rooms_ix
+            self.population_ix_ = self.population_ix
+            self.households_ix_ = self.households_ix
+            self.total_bedrooms_ix_ = self.total_bedrooms_ix
+        self.n_generated_features_ = 3 if self.add_bedrooms_per_room else 2
+
+        # an exact median needs every row, the remaining statistics are streamed
+        all_missing_columns = np.flatnonzero(np.isnan(X).all(axis=0))
+        if len(all_missing_columns) > 0:
+            raise ValueError(f"Columns {all_missing_columns.tolist()} have no observed values to impute from.")
+        self.medians_ = np.nanmedian(X, axis=0)
+
+        n_seen = 0
+        mean = np.zeros(n_columns + self.n_generated_features_, dtype=np.float64)
+        m2 = np.zeros_like(mean)
+        if generated_feature is None:
+            block = np.empty((min(self.block_size, n_rows), mean.shape[0]), dtype=np.float32)
+        for start in range(0, n_rows, self.block_size):
+            X_block = X[start:start + self.block_size]
+            if generated_feature is None:
+                out_block = block[:X_block.shape[0]]
             else:
-                generated_feature = np.c_[
-                    X, room_per_household, population_per_household]
+                out_block = generated_feature[start:start + self.block_size]
+            self._generate_block(X_block, out_block)
+
+            # Chan et al. pairwise update of running mean and sum of squared deviations
+            n_block = out_block.shape[0]
+            block_mean = out_block.mean(axis=0, dtype=np.float64)
+            block_m2 = np.square(out_block - block_mean).sum(axis=0)
+            delta = block_mean - mean
+            n_total = n_seen + n_block
+            mean += delta * n_block / n_total
+            m2 += block_m2 + np.square(delta) * n_seen * n_block / n_total
+            n_seen = n_total
+
+        self.mean_ = mean.astype(np.float32)
+        self.var_ = (m2 / n_seen).astype(np.float32)
+        scale = np.sqrt(self.var_)
+        scale[scale == 0.0] = 1.0
+        self.scale_ = scale
+
+    def fit(self, X, y=None):
+        try:
+            self._fit(np.asarray(X, dtype=np.float32))
+            return self
+        except Exception as e:
+            raise HousingException(e, sys) from e
+
+    def fit_transform(self, X, y=None):
+        try:
+            X = np.asarray(X, dtype=np.float32)
+            n_rows, n_columns = X.shape
+
+            # one pass builds the features and their statistics, scaling is then applied in place
+            n_generated = 3 if self.add_bedrooms_per_room else 2
+            generated_feature = np.empty((n_rows, n_columns + n_generated), dtype=np.float32)
+            self._fit(X, generated_feature=generated_feature)
+            generated_feature -= self.mean_
+            generated_feature /= self.scale_
+            return generated_feature
+        except Exception as e:
+            raise HousingException(e, sys) from e
+
+    def transform(self, X, y=None):
+        try:
+            X = np.asarray(X, dtype=np.float32)
+            n_rows, n_columns = X.shape
+
+            generated_feature = np.empty((n_rows, n_columns + self.n_generated_features_), dtype=np.float32)
+            for start in range(0, n_rows, self.block_size):
+                out_block = generated_feature[start:start + self.block_size]
+                self._generate_block(X[start:start + self.block_size], out_block)
+                out_block -= self.mean_
+                out_block /= self.scale_
 
             return generated_feature
         except Exception as e:
@@ -86,30 +247,36 @@ class DataTransformation:
 
     
 
-    def get_data_transformer_object(self)->ColumnTransformer:
+    def get_data_transformer_object(self, dataset_schema:dict, input_columns:pd.Index)->ColumnTransformer:
         try:
-            schema_file_path = self.data_validation_artifact.schema_file_path
-
-            dataset_schema = read_yaml_file(file_path=schema_file_path)
-
             numerical_columns = dataset_schema[NUMERICAL_COLUMN_KEY]
             categorical_columns = dataset_schema[CATEGORICAL_COLUMN_KEY]
 
+            # columns are selected by position, get_indexer would map a missing
+            # column to -1 and quietly select the last one, so check names first
+            missing_columns = [column for column in [*numerical_columns, *categorical_columns]
+                               if column not in input_columns]
+            if len(missing_columns) > 0:
+                raise Exception(f"Columns {missing_columns} from the schema are not in the input dataframe.")
+            numerical_columns_ix = input_columns.get_indexer(numerical_columns).tolist()
+            categorical_columns_ix = input_columns.get_indexer(categorical_columns).tolist()
+
+            # known levels from the schema spare the encoder a sort-unique scan at fit
+            categories = [dataset_schema[DATASET_SCHEMA_DOMAIN_VALUE_KEY][column] for column in categorical_columns]
+
 
             num_pipeline = Pipeline(steps=[
-                ('imputer', SimpleImputer(strategy="median")),
-                ('feature_generator', FeatureGenerator(
+                ('preprocessor', FusedNumericPreprocessor(
                     add_bedrooms_per_room=self.data_transformation_config.add_bedroom_per_room,
                     columns=numerical_columns
                 )),
-                ('scaler', StandardScaler())
             ]
             )
 
             cat_pipeline = Pipeline(steps=[
                  ('impute', SimpleImputer(strategy="most_frequent")),
-                 ('one_hot_encoder', OneHotEncoder()),
-                 ('scaler', StandardScaler(with_mean=False))
+                 ('one_hot_encoder', OneHotEncoder(categories=categories, sparse_output=False, dtype=np.float32,
+                                                   handle_unknown='ignore')),
             ]
             )
 
@@ -118,9 +285,9 @@ class DataTransformation:
 
 
             preprocessing = ColumnTransformer([
-                ('num_pipeline', num_pipeline, numerical_columns),
-                ('cat_pipeline', cat_pipeline, categorical_columns),
-            ])
+                ('num_pipeline', num_pipeline, numerical_columns_ix),
+                ('cat_pipeline', cat_pipeline, categorical_columns_ix),
+            ], n_jobs=-1)
             return preprocessing
 
         except Exception as e:
@@ -129,44 +296,32 @@ class DataTransformation:
 
     def initiate_data_transformation(self)->DataTransformationArtifact:
         try:
-            logging.info(f"Obtaining preprocessing object.")
-            preprocessing_obj = self.get_data_transformer_object()
-
+            schema_file_path = self.data_validation_artifact.schema_file_path
+            schema = read_yaml_file(file_path=schema_file_path)
 
             logging.info(f"Obtaining training and test file path.")
             train_file_path = self.data_ingestion_artifact.train_file_path
             test_file_path = self.data_ingestion_artifact.test_file_path
             
-
-            schema_file_path = self.data_validation_artifact.schema_file_path
-            
             logging.info(f"Loading training and test data as pandas dataframe.")
-            train_df = load_data(file_path=train_file_path, schema_path=schema_file_path)
+            train_df = load_data(file_path=train_file_path, schema_path=schema_file_path, dataset_schema=schema)
             
-            test_df = load_data(file_path=test_file_path, schema_path=schema_file_path)
-
-            schema = read_yaml_file(file_path=schema_file_path)
+            test_df = load_data(file_path=test_file_path, schema_path=schema_file_path, dataset_schema=schema)
 
             target_column_name = schema[TARGET_COLUMN_KEY]
 
-
             logging.info(f"Splitting input and target feature from training and testing dataframe.")
-            input_feature_train_df = train_df.drop(columns=[target_column_name],axis=1)
-            target_feature_train_df = train_df[target_column_name]
+            target_feature_train_df = train_df.pop(target_column_name)
+            input_feature_train_df = train_df
 
-            input_feature_test_df = test_df.drop(columns=[target_column_name],axis=1)
-            target_feature_test_df = test_df[target_column_name]
+            target_feature_test_df = test_df.pop(target_column_name)
+            input_feature_test_df = test_df
             
+            logging.info(f"Obtaining preprocessing object.")
+            preprocessing_obj = self.get_data_transformer_object(dataset_schema=schema,
+                                                                 input_columns=input_feature_train_df.columns)
 
-            logging.info(f"Applying preprocessing object on training dataframe and testing dataframe")
-            input_feature_train_arr=preprocessing_obj.fit_transform(input_feature_train_df)
-            input_feature_test_arr = preprocessing_obj.transform(input_feature_test_df)
-
-
-            train_arr = np.c_[ input_feature_train_arr, np.array(target_feature_train_df)]
 
-            test_arr = np.c_[input_feature_test_arr, np.array(target_feature_test_df)]
-            
             transformed_train_dir = self.data_transformation_config.transformed_train_dir
             transformed_test_dir = self.data_transformation_config.transformed_test_dir
 
@@ -176,15 +331,36 @@ class DataTransformation:
             transformed_train_file_path = os.path.join(transformed_train_dir, train_file_name)
             transformed_test_file_path = os.path.join(transformed_test_dir, test_file_name)
 
-            logging.info(f"Saving transformed training and testing array.")
-            
-            save_numpy_array_data(file_path=transformed_train_file_path,array=train_arr)
-            save_numpy_array_data(file_path=transformed_test_file_path,array=test_arr)
-
             preprocessing_obj_file_path = self.data_transformation_config.preprocessed_object_file_path
 
-            logging.info(f"Saving preprocessing object.")
-            save_object(file_path=preprocessing_obj_file_path,obj=preprocessing_obj)
+            logging.info(f"Applying preprocessing object on training dataframe and testing dataframe")
+            input_feature_train_arr=preprocessing_obj.fit_transform(input_feature_train_df)
+            # parallel branches only pay off for the batch fit, the saved object
+            # serves single row predictions and must stay in process
+            preprocessing_obj.set_params(n_jobs=None)
+
+            target_feature_train_arr = np.asarray(target_feature_train_df, dtype=np.float32)
+
+            # file writes release the GIL, so the train array and the fitted object are saved
+            # on worker threads while the test dataframe is transformed here.
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                logging.info(f"Saving transformed training array and preprocessing object.")
+                save_futures = [
+                    executor.submit(save_numpy_feature_target_data, file_path=transformed_train_file_path,
+                                    feature=input_feature_train_arr, target=target_feature_train_arr),
+                    executor.submit(save_object, file_path=preprocessing_obj_file_path, obj=preprocessing_obj),
+                ]
+
+                input_feature_test_arr = preprocessing_obj.transform(input_feature_test_df)
+
+                target_feature_test_arr = np.asarray(target_feature_test_df, dtype=np.float32)
+
+                logging.info(f"Saving transformed testing array.")
+                save_numpy_feature_target_data(file_path=transformed_test_file_path,
+                                               feature=input_feature_test_arr, target=target_feature_test_arr)
+
+                for save_future in save_futures:
+                    save_future.result()
 
             data_transformation_artifact = DataTransformationArtifact(is_transformed=True,
             message="Data transformation successfull.",
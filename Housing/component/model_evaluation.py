@@ -91,13 +91,16 @@ class ModelEvaluation:
 
             schema_file_path = self.data_validation_artifact.schema_file_path
 
+            schema_content = read_yaml_file(file_path=schema_file_path)
+
             train_dataframe = load_data(file_path=train_file_path,
                                                            schema_path=schema_file_path,
+                                                           dataset_schema=schema_content,
                                                            )
             test_dataframe = load_data(file_path=test_file_path,
                                                           schema_path=schema_file_path,
+                                                          dataset_schema=schema_content,
                                                           )
-            schema_content = read_yaml_file(file_path=schema_file_path)
             target_column_name = schema_content[TARGET_COLUMN_KEY]
 
             # target_column
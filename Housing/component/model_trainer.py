@@ -4,7 +4,7 @@ from Housing.logger import logging
 from typing import List
 from Housing.entity.artifact_entity import DataTransformationArtifact, ModelTrainerArtifact
 from Housing.entity.config_entity import ModelTrainerConfig
-from Housing.util.util import load_numpy_array_data,save_object,load_object
+from Housing.util.util import load_numpy_feature_target_data,save_object,load_object
 from Housing.entity.model_factory import MetricInfoArtifact,ModelFactory,GridSearchedBestModel
 from Housing.entity.model_factory import evaluate_regression_model
 
@@ -52,14 +52,11 @@ class ModelTrainer:
         try:
             logging.info(f"Loading transformed training dataset")
             transformed_train_file_path=self.data_transformation_artifact.transformed_train_file_path
-            train_array = load_numpy_array_data(file_path=transformed_train_file_path)
+            x_train,y_train = load_numpy_feature_target_data(file_path=transformed_train_file_path)
 
             logging.info(f"Loading transformed testing dataset")
             transformed_test_file_path = self.data_transformation_artifact.transformed_test_file_path
-            test_array = load_numpy_array_data(file_path=transformed_test_file_path)
-
-            logging.info(f"Splitting training and testing input and target feature")
-            x_train,y_train,x_test,y_test = train_array[:,:-1],train_array[:,-1],test_array[:,:-1],test_array[:,-1]
+            x_test,y_test = load_numpy_feature_target_data(file_path=transformed_test_file_path)
             
 
             logging.info(f"Extracting model config file path")
@@ -71,6 +71,7 @@ DATASET_SCHEMA_COLUMNS_KEY=  "columns"
 
 NUMERICAL_COLUMN_KEY="numerical_columns"
 CATEGORICAL_COLUMN_KEY = "categorical_columns"
+DATASET_SCHEMA_DOMAIN_VALUE_KEY = "domain_value"
 
 
 TARGET_COLUMN_KEY="target_column"
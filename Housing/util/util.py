@@ -1,8 +1,11 @@
 import yaml
 from Housing.exception import HousingException
+from Housing.logger import logging
 import os,sys
+import hashlib
+import json
 import numpy as np
-import dill
+import joblib
 import pandas as pd
 from Housing.constant import *
 
@@ -32,32 +35,36 @@ def read_yaml_file(file_path:str)->dict:
     except Exception as e:
         raise HousingException(e,sys) from e
 
-def save_numpy_array_data(file_path: str, array: np.array):
+
+def save_numpy_feature_target_data(file_path: str, feature: np.array, target: np.array):
     """
-    Save numpy array data to file
+    Save input feature and target arrays side by side in one uncompressed .npz file
     file_path: str location of file to save
-    array: np.array data to save
+    feature: np.array input feature data to save
+    target: np.array target data to save
     """
     try:
         dir_path = os.path.dirname(file_path)
         os.makedirs(dir_path, exist_ok=True)
         with open(file_path, 'wb') as file_obj:
-            np.save(file_obj, array)
+            np.savez(file_obj, X=feature, y=target)
     except Exception as e:
         raise HousingException(e, sys) from e
 
 
-def load_numpy_array_data(file_path: str) -> np.array:
+def load_numpy_feature_target_data(file_path: str):
     """
-    load numpy array data from file
+    load input feature and target arrays saved by save_numpy_feature_target_data
     file_path: str location of file to load
-    return: np.array data loaded
+    return: tuple of np.array input feature and target data loaded
     """
     try:
-        with open(file_path, 'rb') as file_obj:
-            return np.load(file_obj)
+        with np.load(file_path) as data:
+            return data['X'], data['y']
     except Exception as e:
         raise HousingException(e, sys) from e
+
+
 def save_object(file_path:str,obj):
     """
     file_path: str
@@ -66,8 +73,7 @@ def save_object(file_path:str,obj):
     try:
         dir_path = os.path.dirname(file_path)
         os.makedirs(dir_path, exist_ok=True)
-        with open(file_path, "wb") as file_obj:
-            dill.dump(obj, file_obj)
+        joblib.dump(obj, file_path, compress=("lz4", 3))
     except Exception as e:
         raise HousingException(e,sys) from e
 
@@ -77,18 +83,47 @@ def load_object(file_path:str):
     file_path: str
     """
     try:
-        with open(file_path, "rb") as file_obj:
-            return dill.load(file_obj)
+        return joblib.load(file_path)
     except Exception as e:
         raise HousingException(e,sys) from e
 
-def load_data(file_path:str,schema_path:str)->pd.DataFrame:
+def load_data(file_path:str,schema_path:str,dataset_schema:dict=None)->pd.DataFrame:
+    """
+    file_path: str location of csv file to load, a parquet copy is cached next to it
+    schema_path: str location of schema file
+    dataset_schema: dict already parsed schema, skips reading schema_path when given
+    """
     try:
-        dataset_schema=read_yaml_file(schema_path)
+        if dataset_schema is None:
+            dataset_schema=read_yaml_file(schema_path)
 
         schema=dataset_schema[DATASET_SCHEMA_COLUMNS_KEY]
 
-        dataframe=pd.read_csv(file_path)
+        numerical_dtype={column:np.float32 for column,column_type in schema.items() if column_type=="float"}
+
+        # parsed csv is cached as a parquet sibling so repeat runs skip csv parsing,
+        # the schema hash in the name keeps a cache typed under another schema from being reused
+        schema_hash=hashlib.md5(json.dumps(schema,sort_keys=True).encode()).hexdigest()[:12]
+        parquet_file_path=f"{os.path.splitext(file_path)[0]}.{schema_hash}.parquet"
+
+        dataframe=None
+        if os.path.exists(parquet_file_path) and os.path.getmtime(parquet_file_path)>=os.path.getmtime(file_path):
+            try:
+                dataframe=pd.read_parquet(parquet_file_path,engine="pyarrow")
+            except Exception as e:
+                logging.warning(f"Ignoring unreadable parquet cache [{parquet_file_path}]: {e}")
+
+        if dataframe is None:
+            dataframe=pd.read_csv(file_path,engine="pyarrow",dtype=numerical_dtype)
+            # written under a temporary name and renamed so a killed write never leaves a partial cache
+            temp_file_path=f"{parquet_file_path}.{os.getpid()}.tmp"
+            try:
+                dataframe.to_parquet(temp_file_path,engine="pyarrow",compression="zstd",index=False)
+                os.replace(temp_file_path,parquet_file_path)
+            except Exception as e:
+                logging.warning(f"Could not cache [{file_path}] as parquet at [{parquet_file_path}]: {e}")
+                if os.path.exists(temp_file_path):
+                    os.remove(temp_file_path)
 
         error_messgae=""
 